@@ -2,17 +2,33 @@
 
 import cv2
 import numpy as np
+import functools
+import itertools
+import multiprocessing
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from skimage import img_as_float32, img_as_uint
 from skimage.color import rgb2lab, lab2rgb
 from skimage.filters import gaussian
-from skimage.registration import phase_cross_correlation
 import PIL.Image
 import PIL.ImageCms
 import cupy as cp  # GPU array operations
+from cupyx.scipy import ndimage as cpx_ndi  # GPU equivalents of scipy.ndimage filters
+from cupyx.scipy import fft as cpx_fft
+from tiling import tile_starts, tile_weights
 # Initialize GPU device
 cp.cuda.Device(0).use()
 
+# Stack filename patterns, tried in order: trailing number, number followed by
+# a separator, leading number. Each alternative captures (base, number) or
+# (number, rest) and the longer group becomes the stack name.
+_STACK_RE = re.compile(
+    r'^(?:(.*?)[-_]?(\d+)'
+    r'|(.*?)[-_]?(\d+)[-_].*'
+    r'|(\d+)[-_]?(.*?))$'
+)
+
 # Create reusable kernels for common operations
 laplace_kernel = cp.array([[0, 1, 0],
                           [1, -4, 1],
@@ -40,6 +56,319 @@ detail_kernel = cp.array([[-1,-2,-1],
                          [-2, 13,-2],
                          [-1,-2,-1]], dtype=cp.float32)
 
+# Gradient magnitude from Sobel derivatives in one pass, without the dx*dx and
+# dy*dy temporaries
+_gradient_magnitude = cp.ElementwiseKernel(
+    'T dx, T dy', 'T m',
+    'float fx = dx, fy = dy; m = sqrtf(fx * fx + fy * fy)',
+    'gradient_magnitude')
+
+# Weighted accumulation of one focus measure scale: the squared difference of
+# Gaussians is added to the accumulator without materializing the DoG itself
+_focus_accumulate = cp.ElementwiseKernel(
+    'float32 fine, float32 coarse, float32 w',
+    'float32 acc',
+    'float d = fine - coarse; acc += w * d * d',
+    'focus_accumulate')
+
+# Bilateral filter matching cv2.bilateralFilter (circular window, reflect-101 borders)
+# for single-channel float32 or float16 maps. Leading axes are treated as independent
+# planes. Half precision maps are filtered with float32 arithmetic.
+_bilateral_module = cp.RawModule(code=r'''
+#include <cuda_fp16.h>
+
+__device__ __forceinline__ float load_value(float v) { return v; }
+__device__ __forceinline__ float load_value(__half v) { return __half2float(v); }
+__device__ __forceinline__ void store_value(float* p, float v) { *p = v; }
+__device__ __forceinline__ void store_value(__half* p, float v) { *p = __float2half(v); }
+
+template<typename T>
+__global__ void bilateral_filter(const T* src, T* dst, long long total,
+                                 int height, int width, int radius,
+                                 float color_coeff, float space_coeff)
+{
+    long long idx = (long long)blockDim.x * blockIdx.x + threadIdx.x;
+    if (idx >= total) return;
+    int x = idx % width;
+    int y = (idx / width) % height;
+    const T* plane = src + (idx - (long long)y * width - x);
+    float center = load_value(plane[y * width + x]);
+    float sum = 0.0f;
+    float wsum = 0.0f;
+    for (int dy = -radius; dy <= radius; dy++) {
+        int yy = y + dy;
+        yy = yy < 0 ? -yy : (yy >= height ? 2 * height - 2 - yy : yy);
+        for (int dx = -radius; dx <= radius; dx++) {
+            int r2 = dx * dx + dy * dy;
+            if (r2 > radius * radius) continue;
+            int xx = x + dx;
+            xx = xx < 0 ? -xx : (xx >= width ? 2 * width - 2 - xx : xx);
+            float v = load_value(plane[yy * width + xx]);
+            float diff = v - center;
+            float w = __expf(r2 * space_coeff + diff * diff * color_coeff);
+            sum += v * w;
+            wsum += w;
+        }
+    }
+    store_value(dst + idx, sum / wsum);
+}
+''', name_expressions=('bilateral_filter<float>', 'bilateral_filter<__half>'))
+
+# Tiled convolution for the small sharpening kernels. Each 16x16 block stages its
+# tile plus a radius-wide halo in shared memory, the flipped kernel weights live
+# in constant memory. Borders are reflected like ndimage mode='reflect'.
+_conv_module = cp.RawModule(code=r'''
+#define TILE 16
+
+__constant__ float c_weights[25];
+
+__device__ __forceinline__ int reflect_index(int i, int n)
+{
+    if (i < 0) return -i - 1;
+    if (i >= n) return 2 * n - i - 1;
+    return i;
+}
+
+template<int R>
+__global__ void conv2d_tiled(const float* __restrict__ src, float* __restrict__ dst,
+                             int height, int width, int channels,
+                             int first_channel, int dst_channels)
+{
+    __shared__ float tile[TILE + 2 * R][TILE + 2 * R];
+    const int c = first_channel + blockIdx.z;
+    const int x0 = blockIdx.x * TILE - R;
+    const int y0 = blockIdx.y * TILE - R;
+    for (int i = threadIdx.y * TILE + threadIdx.x; i < (TILE + 2 * R) * (TILE + 2 * R);
+         i += TILE * TILE) {
+        int ty = i / (TILE + 2 * R);
+        int tx = i % (TILE + 2 * R);
+        int y = reflect_index(y0 + ty, height);
+        int x = reflect_index(x0 + tx, width);
+        tile[ty][tx] = src[((long long)y * width + x) * channels + c];
+    }
+    __syncthreads();
+
+    const int x = blockIdx.x * TILE + threadIdx.x;
+    const int y = blockIdx.y * TILE + threadIdx.y;
+    if (x >= width || y >= height) return;
+    float acc = 0.0f;
+    #pragma unroll
+    for (int ky = 0; ky < 2 * R + 1; ky++) {
+        #pragma unroll
+        for (int kx = 0; kx < 2 * R + 1; kx++) {
+            acc += c_weights[ky * (2 * R + 1) + kx] * tile[threadIdx.y + ky][threadIdx.x + kx];
+        }
+    }
+    dst[((long long)y * width + x) * dst_channels + blockIdx.z] = acc;
+}
+''', name_expressions=('conv2d_tiled<1>', 'conv2d_tiled<2>'))
+
+def _gaussian_blur(img, ksize, sigma=0, out=None):
+    """
+    GPU replacement for cv2.GaussianBlur with a square kernel
+    @param img: CuPy array to blur, leading axes are treated as independent planes
+    @param ksize: Odd kernel size, as passed to cv2.GaussianBlur
+    @param sigma: Gaussian sigma, 0 derives it from ksize like OpenCV does
+    @param out: Optional preallocated output array
+    """
+    if sigma <= 0:
+        sigma = 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+    sigmas = (0,) * (img.ndim - 2) + (sigma, sigma)
+    # Truncate so the filter footprint matches the OpenCV kernel size
+    return cpx_ndi.gaussian_filter(img, sigmas, output=out, mode='mirror',
+                                   truncate=(ksize // 2) / sigma)
+
+def _sobel(img, axis):
+    """
+    GPU replacement for cv2.Sobel with ksize=3 over the last two axes
+    @param img: CuPy array, leading axes are treated as independent planes
+    @param axis: -1 for the x derivative, -2 for the y derivative
+    """
+    # cupyx sobel would also smooth across the leading axes, so apply the
+    # separable derivative and smoothing passes explicitly
+    smooth_axis = -2 if axis == -1 else -1
+    out = cpx_ndi.correlate1d(img, [-1, 0, 1], axis=axis, mode='mirror')
+    return cpx_ndi.correlate1d(out, [1, 2, 1], axis=smooth_axis, mode='mirror')
+
+def _gpu_resize(img, shape):
+    """
+    GPU replacement for cv2.resize with bilinear interpolation
+    @param img: CuPy array, the last two axes are resized
+    @param shape: Target (height, width)
+    """
+    zoom = (1,) * (img.ndim - 2) + (shape[0] / img.shape[-2], shape[1] / img.shape[-1])
+    return cpx_ndi.zoom(img, zoom, order=1, mode='nearest', grid_mode=True)
+
+def _pyramid_blur(img, ksize, sigma, factor=4):
+    """
+    Large Gaussian blur computed on a block-averaged copy of the image
+    @param img: CuPy array, the last two axes are blurred
+    @param ksize: Odd kernel size at full resolution
+    @param sigma: Gaussian sigma at full resolution
+    @param factor: Downsampling factor, used once sigma reaches 10
+    """
+    if sigma < 10:
+        return _gaussian_blur(img, ksize, sigma)
+    
+    # Pad to a multiple of the factor so blocks line up with the upsampling grid
+    lead = img.shape[:-2]
+    height, width = img.shape[-2:]
+    pad_h, pad_w = -height % factor, -width % factor
+    if pad_h or pad_w:
+        img = cp.pad(img, [(0, 0)] * len(lead) + [(0, pad_h), (0, pad_w)], mode='edge')
+    padded_h, padded_w = height + pad_h, width + pad_w
+    
+    down = img.reshape(lead + (padded_h // factor, factor, padded_w // factor, factor)).mean(axis=(-3, -1))
+    down = _gaussian_blur(down, (ksize // factor) | 1, sigma / factor)
+    return _gpu_resize(down, (padded_h, padded_w))[..., :height, :width]
+
+def _convolve_tiled(img, weights, channel=None):
+    """
+    Convolve with a 3x3 or 5x5 kernel using the shared-memory tiled kernel
+    @param img: (H, W) or (H, W, C) float32 CuPy array
+    @param weights: Square kernel with radius 1 or 2
+    @param channel: Only convolve this channel and return a (H, W) array
+    """
+    img = cp.ascontiguousarray(img, dtype=cp.float32)
+    height, width = img.shape[:2]
+    channels = img.shape[2] if img.ndim == 3 else 1
+    if channel is None:
+        first_channel, count = 0, channels
+        out = cp.empty_like(img)
+    else:
+        first_channel, count = channel, 1
+        out = cp.empty((height, width), dtype=cp.float32)
+    
+    # Convolution flips the kernel, the device code correlates
+    flipped = cp.ascontiguousarray(weights[::-1, ::-1], dtype=cp.float32)
+    _conv_module.get_global('c_weights').copy_from_device_async(flipped.data, flipped.nbytes)
+    
+    kernel = _conv_module.get_function(f'conv2d_tiled<{weights.shape[0] // 2}>')
+    grid = ((width + 15) // 16, (height + 15) // 16, count)
+    kernel(grid, (16, 16), (
+        img, out, cp.int32(height), cp.int32(width), cp.int32(channels),
+        cp.int32(first_channel), cp.int32(count)
+    ))
+    return out
+
+@functools.lru_cache(maxsize=16)
+def _fft_plan(shape):
+    """
+    Cached cuFFT plan for 2D complex64 transforms of the given shape
+    """
+    return cpx_fft.get_fft_plan(cp.empty(shape, dtype=cp.complex64), axes=(0, 1))
+
+def _fft2(img):
+    """
+    2D FFT through the cached plan for the image shape
+    """
+    with _fft_plan(img.shape):
+        return cp.fft.fft2(img.astype(cp.complex64, copy=False))
+
+def _ifft2(spectrum):
+    """
+    Inverse 2D FFT through the cached plan for the spectrum shape
+    """
+    with _fft_plan(spectrum.shape):
+        return cp.fft.ifft2(spectrum)
+
+def _upsampled_dft(data, region_size, upsample_factor, offsets):
+    """
+    Matrix-multiply DFT of a small upsampled region around a correlation peak
+    (Guizar-Sicairos et al. 2008), same as skimage.registration uses
+    """
+    for n_items, offset in zip(data.shape[::-1], offsets[::-1]):
+        kernel = (cp.arange(region_size) - offset)[:, None] * cp.fft.fftfreq(n_items, upsample_factor)
+        kernel = cp.exp(-2j * cp.pi * kernel)
+        data = cp.tensordot(kernel, data, axes=(1, -1))
+    return data
+
+def _phase_correlate_gpu(ref_spectrum, mov, upsample_factor=20):
+    """
+    GPU replacement for skimage.registration.phase_cross_correlation
+    @param ref_spectrum: _fft2 of the reference image, reusable across images
+    @param mov: Moving image as a 2D CuPy array with the reference shape
+    @param upsample_factor: Sub-pixel precision is 1/upsample_factor
+    @return: Shift (row, col) that registers mov with the reference, as a NumPy array
+    """
+    image_product = ref_spectrum * _fft2(mov).conj()
+    image_product /= cp.maximum(cp.abs(image_product), 100 * np.finfo(np.float32).eps)
+    cross_correlation = _ifft2(image_product)
+    
+    # Whole-pixel peak, only the peak index leaves the GPU
+    shape = np.array(mov.shape)
+    peak = int(cp.argmax(cp.abs(cross_correlation)))
+    shifts = np.array(np.unravel_index(peak, mov.shape), dtype=np.float64)
+    wrapped = shifts > shape // 2
+    shifts[wrapped] -= shape[wrapped]
+    
+    if upsample_factor > 1:
+        # Refine within 1.5 pixels of the initial estimate
+        shifts = np.round(shifts * upsample_factor) / upsample_factor
+        region_size = int(np.ceil(upsample_factor * 1.5))
+        dftshift = np.fix(region_size / 2.0)
+        offsets = dftshift - shifts * upsample_factor
+        region = _upsampled_dft(image_product.conj(), region_size, upsample_factor, offsets).conj()
+        peak = int(cp.argmax(cp.abs(region)))
+        maxima = np.array(np.unravel_index(peak, region.shape), dtype=np.float64)
+        shifts = shifts + (maxima - dftshift) / upsample_factor
+    
+    return shifts
+
+class ProcessingStopped(Exception):
+    """Raised inside process_stack when its should_stop callback asks to stop"""
+
+def _checkpoint(progress_cb, should_stop, percent):
+    """
+    Report stack progress and bail out if the caller asked to stop
+    @param progress_cb: Callable receiving the progress (0-100) or None
+    @param should_stop: Callable returning True to stop, or None
+    @param percent: Current progress of the stack
+    """
+    if should_stop is not None and should_stop():
+        raise ProcessingStopped("Processing stopped")
+    if progress_cb is not None:
+        progress_cb(int(percent))
+
+def _pinned_empty(shape, dtype):
+    """
+    Allocate a NumPy array backed by page-locked host memory
+    @param shape: Array shape
+    @param dtype: Array dtype
+    """
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    mem = cp.cuda.alloc_pinned_memory(count * dtype.itemsize)
+    return np.frombuffer(mem, dtype, count).reshape(shape)
+
+def _bilateral_filter(img, d, sigma_color, sigma_space, out=None):
+    """
+    GPU replacement for cv2.bilateralFilter on single-channel float32 or float16 maps
+    @param img: CuPy array, the last two axes are filtered
+    @param d: Diameter of the pixel neighborhood
+    @param sigma_color: Filter sigma in the value domain
+    @param sigma_space: Filter sigma in the coordinate domain
+    @param out: Optional preallocated contiguous output with the shape and dtype of img
+    """
+    if img.dtype == cp.float16:
+        kernel = _bilateral_module.get_function('bilateral_filter<__half>')
+    else:
+        img = img.astype(cp.float32, copy=False)
+        kernel = _bilateral_module.get_function('bilateral_filter<float>')
+    img = cp.ascontiguousarray(img)
+    if out is None:
+        out = cp.empty_like(img)
+    height, width = img.shape[-2:]
+    block = 256
+    grid = (img.size + block - 1) // block
+    kernel((grid,), (block,), (
+        img, out, cp.int64(img.size),
+        cp.int32(height), cp.int32(width), cp.int32(max(d // 2, 1)),
+        cp.float32(-0.5 / (sigma_color * sigma_color)),
+        cp.float32(-0.5 / (sigma_space * sigma_space))
+    ))
+    return out
+
 class FocusStacker:
     def __init__(self, radius=8, smoothing=4, scale_factor=2):
         """
@@ -51,6 +380,21 @@ class FocusStacker:
                            3 = 3x upscaling (more detail, slower)
                            4 = 4x upscaling (maximum detail, much slower)
         """
+        self.set_params(radius, smoothing, scale_factor)
+        self._staging_buffers = {}
+        self._scratch_buffers = {}
+        # Separate streams so uploads overlap with focus measure kernels
+        self.stream_copy = cp.cuda.Stream(non_blocking=True)
+        self.stream_compute = cp.cuda.Stream(non_blocking=True)
+        self._init_color_profiles()
+
+    def set_params(self, radius, smoothing, scale_factor):
+        """
+        Update the stacking parameters in place, keeping streams and buffers
+        @param radius: Size of the focus measure window (1-20)
+        @param smoothing: Amount of smoothing applied to focus maps (1-10)
+        @param scale_factor: Processing scale multiplier (1-4)
+        """
         if not 1 <= radius <= 20:
             raise ValueError("Radius must be between 1 and 20")
         if not 1 <= smoothing <= 10:
@@ -62,65 +406,115 @@ class FocusStacker:
         self.smoothing = smoothing
         self.scale_factor = scale_factor
         self.window_size = 2 * radius + 1
-        self._init_color_profiles()
 
     def _init_color_profiles(self):
         self.color_profiles = {
             'sRGB': PIL.ImageCms.createProfile('sRGB')
         }
 
+    def _staging_buffer(self, shape, dtype=np.float32, slot=0):
+        """
+        Reusable page-locked host buffer for uploads of a given shape
+        @param shape: Buffer shape
+        @param dtype: Buffer dtype
+        @param slot: Separate buffers of the same shape for uploads still in flight
+        """
+        key = (tuple(shape), np.dtype(dtype), slot)
+        if key not in self._staging_buffers:
+            self._staging_buffers[key] = _pinned_empty(shape, dtype)
+        return self._staging_buffers[key]
+
+    def _scratch_buffer(self, slot, shape, dtype=cp.float32):
+        """
+        Reusable device buffer for filter outputs in the per-frame and per-batch loops
+        @param slot: Name of the buffer, one buffer is kept per slot
+        @param shape: Buffer shape
+        @param dtype: Buffer dtype
+        """
+        buf = self._scratch_buffers.get(slot)
+        # Reallocate when the shape changes (e.g. edge tiles) so memory stays bounded
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = cp.empty(shape, dtype=dtype)
+            self._scratch_buffers[slot] = buf
+        return buf
+
+    def _upload(self, arr, dtype=np.float32):
+        """
+        Upload a host array through a reusable page-locked staging buffer
+        @param arr: NumPy array to upload
+        @param dtype: Device dtype, the cast happens during the staging copy
+        """
+        staging = self._staging_buffer(arr.shape, dtype)
+        if staging is not arr:
+            staging[...] = arr
+        gpu_arr = cp.empty(arr.shape, dtype=dtype)
+        gpu_arr.set(staging)
+        return gpu_arr
+
     def _load_image(self, path):
         img = cv2.imread(path, cv2.IMREAD_COLOR)
         if img is None:
             raise ValueError(f"Failed to load image: {path}")
-        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255
+        return self._to_float_rgb(img)
+
+    def _decode_image(self, buffer):
+        """
+        Decode an encoded image file held in memory
+        @param buffer: File contents as bytes
+        """
+        img = cv2.imdecode(np.frombuffer(buffer, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Failed to decode image buffer")
+        return self._to_float_rgb(img)
+
+    def _to_float_rgb(self, img):
+        """
+        Convert a decoded 8-bit BGR image to float32 RGB in [0, 1]
+        """
+        # BGR to RGB, float conversion and scaling in a single pass. Frames stay in
+        # pageable memory, uploads go through the reusable staging buffers.
+        rgb = np.empty(img.shape, dtype=np.float32)
+        np.multiply(img[..., ::-1], np.float32(1 / 255), out=rgb, dtype=np.float32)
+        return rgb
 
-    def _align_images(self, images):
+    def _align_images(self, images, checkpoint=None):
+        """
+        @param images: Images to align to the first one
+        @param checkpoint: Optional callable receiving the aligned fraction before each image
+        """
         print("\nAligning images using GPU...")
         reference = images[0]
         aligned = [reference]
         
         ref_gray = cv2.cvtColor((reference * 255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        gpu_ref = cp.asarray(ref_gray.astype(np.float32))
         
-        # Convert to GPU and normalize
-        gpu_ref = cp.asarray(ref_gray.astype(np.float32))
-        gpu_ref = (gpu_ref - cp.min(gpu_ref)) / (cp.max(gpu_ref) - cp.min(gpu_ref))
+        # Enhanced multi-scale alignment with finer scale steps
+        scales = [1.0, 0.8, 0.6, 0.4, 0.2]  # More granular scale steps
+        # The reference pyramid and its spectra are shared by every image in the stack
+        ref_pyramid = self._pyramid(self._upload(ref_gray), scales)
+        ref_spectra = {scale: _fft2(level) for scale, level in ref_pyramid.items()}
+        del ref_pyramid
         
         for i, img in enumerate(images[1:], 1):
+            if checkpoint is not None:
+                checkpoint(i / len(images))
             print(f"Aligning image {i+1} with reference...")
             
             try:
                 img_gray = cv2.cvtColor((img * 255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
                 img_gray = cv2.normalize(img_gray, None, 0, 255, cv2.NORM_MINMAX)
                 
-                # Enhanced multi-scale alignment with finer scale steps
-                scales = [1.0, 0.8, 0.6, 0.4, 0.2]  # More granular scale steps
+                # One upload per image, all scales are built on the GPU
+                img_pyramid = self._pyramid(self._upload(img_gray), scales)
+                
                 best_shift = None
                 best_error = float('inf')
                 
                 for scale in scales:
-                    if scale != 1.0:
-                        width = int(img_gray.shape[1] * scale)
-                        height = int(img_gray.shape[0] * scale)
-                        scaled_ref = cv2.resize(ref_gray, (width, height))
-                        scaled_img = cv2.resize(img_gray, (width, height))
-                    else:
-                        scaled_ref = ref_gray
-                        scaled_img = img_gray
-                    
-                    # Convert to GPU arrays first
-                    gpu_scaled_ref = cp.asarray(scaled_ref.astype(np.float32))
-                    gpu_scaled_img = cp.asarray(scaled_img.astype(np.float32))
-                    
-                    # Apply contrast enhancement directly on GPU
-                    gpu_scaled_ref = (gpu_scaled_ref - cp.min(gpu_scaled_ref)) / (cp.max(gpu_scaled_ref) - cp.min(gpu_scaled_ref))
-                    gpu_scaled_img = (gpu_scaled_img - cp.min(gpu_scaled_img)) / (cp.max(gpu_scaled_img) - cp.min(gpu_scaled_img))
-                    
-                    # Enhanced phase correlation with higher upsampling
-                    shift, error, _ = phase_cross_correlation(
-                        gpu_scaled_ref.get(),
-                        gpu_scaled_img.get(),
+                    # Enhanced phase correlation with higher upsampling, computed on GPU
+                    shift = _phase_correlate_gpu(
+                        ref_spectra[scale],
+                        img_pyramid[scale],
                         upsample_factor=20  # Increased precision
                     )
                     
@@ -147,6 +541,7 @@ class FocusStacker:
                 
                 shift = best_shift
                 error = best_error
+                del img_pyramid
                 print(f"Detected shift: {shift}, error: {error}")
                 
                 M = np.float32([[1, 0, -shift[1]], [0, 1, -shift[0]]])
@@ -184,25 +579,51 @@ class FocusStacker:
         
         return aligned
 
-    def _focus_measure(self, img):
+    def _pyramid(self, gpu_img, scales):
         """
-        Optimized focus measure calculation using parallel GPU operations
+        Contrast-normalized copies of a grayscale image at each alignment scale
+        @param gpu_img: Full resolution grayscale image on the GPU
+        @param scales: Scale factors, 1.0 keeps the full resolution
+        @return: Dict mapping each scale to its level
+        """
+        pyramid = {}
+        for scale in scales:
+            if scale != 1.0:
+                shape = (int(gpu_img.shape[0] * scale), int(gpu_img.shape[1] * scale))
+                level = _gpu_resize(gpu_img, shape)
+            else:
+                level = gpu_img
+            pyramid[scale] = (level - cp.min(level)) / (cp.max(level) - cp.min(level))
+        return pyramid
+
+    def _focus_gray(self, img):
+        """
+        Convert an image to the 8-bit grayscale input of the focus measure
         """
         if len(img.shape) == 3:
-            img = cv2.cvtColor((img * 255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            img = (img * 255).astype(np.uint8)
-            
-        # Convert to GPU array once
-        gpu_img = cp.asarray(img.astype(np.float32))
-        
-        # Pre-calculate common image derivatives for all scales
-        dx = cp.asarray(cv2.Sobel(cp.asnumpy(gpu_img), cv2.CV_32F, 1, 0, ksize=3))
-        dy = cp.asarray(cv2.Sobel(cp.asnumpy(gpu_img), cv2.CV_32F, 0, 1, ksize=3))
-        gradient_magnitude = cp.sqrt(dx*dx + dy*dy)
-        
-        # Pre-calculate Laplacian for edge detection
-        laplacian = cp.asarray(cv2.Laplacian(cp.asnumpy(gpu_img), cv2.CV_32F))
+            return cv2.cvtColor((img * 255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
+        return (img * 255).astype(np.uint8)
+
+    def _upload_gray_async(self, img, slot):
+        """
+        Convert an image to grayscale and start its upload on the copy stream
+        @param img: Image to upload
+        @param slot: Staging buffer slot, alternate slots to keep one upload in flight
+        @return: Device array and the event recorded once the copy has finished
+        """
+        gray = self._focus_gray(img)
+        # Upload 8-bit data, the float conversion happens on the GPU
+        staging = self._staging_buffer(gray.shape, np.uint8, slot)
+        staging[...] = gray
+        gpu_gray = cp.empty(gray.shape, dtype=cp.uint8)
+        gpu_gray.set(staging, stream=self.stream_copy)
+        return gpu_gray, self.stream_copy.record()
+
+    def _focus_measure_gpu(self, gpu_img):
+        """
+        Focus measure of an 8-bit grayscale image that is already on the GPU
+        """
+        gpu_img = gpu_img.astype(cp.float32)
         
         # Parallel multi-scale analysis
         scales = [1.0, 0.5, 0.25]
@@ -212,69 +633,52 @@ class FocusStacker:
         
         for scale, weight in zip(scales, weights):
             if scale != 1.0:
-                scaled = cp.asarray(cv2.resize(cp.asnumpy(gpu_img), None, fx=scale, fy=scale))
-                scaled_grad = cp.asarray(cv2.resize(cp.asnumpy(gradient_magnitude), None, fx=scale, fy=scale))
-                scaled_lap = cp.asarray(cv2.resize(cp.asnumpy(laplacian), None, fx=scale, fy=scale))
+                scaled_shape = (round(gpu_img.shape[0] * scale), round(gpu_img.shape[1] * scale))
+                scaled = _gpu_resize(gpu_img, scaled_shape)
             else:
                 scaled = gpu_img
-                scaled_grad = gradient_magnitude
-                scaled_lap = laplacian
-            
-            # Parallel frequency analysis
-            high_freq = cp.abs(scaled - cp.asarray(cv2.GaussianBlur(cp.asnumpy(scaled), (5,5), 0)))
-            
-            # Parallel edge detection
-            edge_strength = cp.abs(scaled_lap)
-            
-            # Local contrast in parallel
-            local_mean = cp.asarray(cv2.GaussianBlur(cp.asnumpy(scaled), (7,7), 1.5))
-            local_contrast = cp.abs(scaled - local_mean)
             
-            # Combine measures
-            scale_measure = high_freq * edge_strength * local_contrast * scaled_grad
+            # Difference of Gaussians band-pass as the high frequency response
+            fine = cpx_ndi.gaussian_filter(scaled, 1.0, mode='mirror',
+                                           output=self._scratch_buffer(f'dog_fine_{scale}', scaled.shape))
+            coarse = cpx_ndi.gaussian_filter(scaled, 2.0, mode='mirror',
+                                             output=self._scratch_buffer(f'dog_coarse_{scale}', scaled.shape))
             
-            # Resize back to original size if needed
-            if scale != 1.0:
-                scale_measure = cp.asarray(cv2.resize(cp.asnumpy(scale_measure), (gpu_img.shape[1], gpu_img.shape[0])))
-            
-            focus_map += weight * scale_measure
+            # Combine measures, resizing back to original size if needed
+            if scale == 1.0:
+                _focus_accumulate(fine, coarse, weight, focus_map)
+                # Full resolution DoG magnitude doubles as the edge response
+                edge_response = cp.abs(fine - coarse)
+            else:
+                scale_measure = cp.zeros_like(scaled)
+                _focus_accumulate(fine, coarse, 1.0, scale_measure)
+                focus_map += weight * _gpu_resize(scale_measure, gpu_img.shape)
+                del scale_measure, scaled
             
             # Clear intermediate results
-            del high_freq, edge_strength, local_mean, local_contrast, scale_measure
-            if scale != 1.0:
-                del scaled, scaled_grad, scaled_lap
+            del fine, coarse
         
         # Final enhancement
         focus_map = (focus_map - cp.min(focus_map)) / (cp.max(focus_map) - cp.min(focus_map) + 1e-6)
         
         # Edge-aware enhancement
-        edge_mask = cp.clip(cp.abs(laplacian) / (cp.max(cp.abs(laplacian)) + 1e-6), 0, 1)
+        edge_mask = cp.clip(edge_response / (cp.max(edge_response) + 1e-6), 0, 1)
         focus_map = focus_map * (1.0 + 0.2 * edge_mask)
         
         # Normalize and cleanup
         focus_map = cp.clip((focus_map - cp.min(focus_map)) / (cp.max(focus_map) - cp.min(focus_map) + 1e-6), 0, 1)
         
-        result = cp.asnumpy(focus_map).astype(np.float32)
-        
-        # Clear GPU memory
-        del gpu_img, dx, dy, gradient_magnitude, laplacian, focus_map, edge_mask
-        cp.get_default_memory_pool().free_all_blocks()
+        # Temporaries go back to the memory pool for the next frame
+        del gpu_img, edge_response, edge_mask
         
-        return result
+        return focus_map.astype(cp.float32, copy=False)
 
     def _blend_images(self, aligned_images, focus_maps):
         """
         Enhanced blending with depth-aware processing and GPU optimization
         """
         h, w = aligned_images[0].shape[:2]
-        if self.scale_factor > 1:
-            new_h, new_w = h * self.scale_factor, w * self.scale_factor
-        else:
-            new_h, new_w = h, w
-            
-        # Initialize result arrays on GPU
-        result = cp.zeros((new_h, new_w, 3), dtype=cp.float32)
-        weights_sum = cp.zeros((new_h, new_w, 1), dtype=cp.float32)
+        new_h, new_w = h * self.scale_factor, w * self.scale_factor
         
         # Pre-process focus maps to match dimensions
         resized_focus_maps = []
@@ -283,31 +687,183 @@ class FocusStacker:
                 fm = cv2.resize(fm, (w, h), interpolation=cv2.INTER_LINEAR)
             resized_focus_maps.append(fm)
         
-        # Process each image with optimized GPU operations
-        for img, fm in zip(aligned_images, resized_focus_maps):
-            # Clear GPU cache before processing each image
+        # Upscaled frames that do not fit on the GPU are blended tile by tile
+        if self.scale_factor > 1 and not self._blend_fits_on_gpu(new_h, new_w):
+            print(f"Upscaled frame {new_w}x{new_h} exceeds free GPU memory, blending in tiles")
+            return self._blend_tiled(aligned_images, resized_focus_maps)
+        
+        result, _ = self._fuse_region(aligned_images, resized_focus_maps)
+        result_range = (float(cp.min(result)), float(cp.max(result)))
+        return self._finish_region(result, resized_focus_maps,
+                                   self._reference_stats(aligned_images[0]), result_range)
+
+    def _blend_tiled(self, aligned, focus_maps, tile=1024, overlap=64, halo=256):
+        """
+        Blend in overlapping tiles so GPU memory is bounded by the tile size. The
+        fused tiles stay in host memory until all of them are fused, because the
+        finishing normalizes with statistics of the whole frame
+        @param aligned: Aligned images
+        @param focus_maps: Focus maps matching the image size
+        @param tile: Tile size at processing scale
+        @param overlap: Overlap between neighbouring tiles at processing scale
+        @param halo: Extra context around each tile for the large focus map blurs
+        """
+        h, w = aligned[0].shape[:2]
+        scale = self.scale_factor
+        
+        # Tile geometry in input pixels, the processing scale is applied per tile
+        overlap_in = max(1, overlap // scale)
+        tile_in = max(tile // scale, 2 * overlap_in + 1)
+        halo_in = -(-halo // scale)
+        ys = tile_starts(h, tile_in, overlap_in)
+        xs = tile_starts(w, tile_in, overlap_in)
+        y_weights = tile_weights(ys, h, tile_in, overlap_in)
+        x_weights = tile_weights(xs, w, tile_in, overlap_in)
+        tiles = list(itertools.product(enumerate(ys), enumerate(xs)))
+        print(f"Blending {len(tiles)} tiles of {tile_in}x{tile_in} input pixels")
+        
+        # Per-frame fusion statistics come from one pass over the whole frame at
+        # input scale, which fits because only the upscaled frame did not. The
+        # blurs there cover the same image area, but the depth gradients are
+        # scale times steeper per pixel than at processing scale.
+        _, frame_stats = self._fuse_region(aligned, focus_maps, scale=1)
+        frame_stats['mask_min'] = frame_stats['mask_min'] / scale
+        frame_stats['mask_max'] = frame_stats['mask_max'] / scale
+        cp.get_default_memory_pool().free_all_blocks()
+        
+        # Fuse every tile with those statistics, tracking the global result range
+        # and the per-channel sharpening statistics of the fused frame
+        fused = []
+        result_min, result_max = np.inf, -np.inf
+        var_min, var_max, contrast_max = np.inf, -np.inf, 0.0
+        for (_, y0), (_, x0) in tiles:
+            y1, x1 = min(y0 + tile_in, h), min(x0 + tile_in, w)
+            hy0, hx0 = max(y0 - halo_in, 0), max(x0 - halo_in, 0)
+            hy1, hx1 = min(y1 + halo_in, h), min(x1 + halo_in, w)
+            context = (slice(hy0, hy1), slice(hx0, hx1))
+            tile_fused, _ = self._fuse_region([img[context] for img in aligned],
+                                              [fm[context] for fm in focus_maps], frame_stats)
+            core = (slice((y0 - hy0) * scale, (y1 - hy0) * scale),
+                    slice((x0 - hx0) * scale, (x1 - hx0) * scale))
+            result_min = min(result_min, float(cp.min(tile_fused[core])))
+            result_max = max(result_max, float(cp.max(tile_fused[core])))
+            local_var = self._local_variance(tile_fused)[core]
+            local_contrast = cp.abs(_convolve_tiled(tile_fused, laplace_kernel))[core]
+            var_min = np.minimum(var_min, cp.min(local_var, axis=(0, 1)).get())
+            var_max = np.maximum(var_max, cp.max(local_var, axis=(0, 1)).get())
+            contrast_max = np.maximum(contrast_max, cp.max(local_contrast, axis=(0, 1)).get())
+            fused.append(cp.asnumpy(tile_fused[core]))
+            del tile_fused, local_var, local_contrast
             cp.get_default_memory_pool().free_all_blocks()
+        
+        # _finish_region maps brightness linearly before sharpening, clipping
+        # aside, which scales local variance by the gain squared and the laplacian
+        # by the gain
+        ref_stats = self._reference_stats(aligned[0])
+        gain = 1.1 * (ref_stats['max'] - ref_stats['min']) / (result_max - result_min + 1e-6)
+        sharpen_stats = {
+            'var_min': var_min * gain ** 2,
+            'var_max': var_max * gain ** 2,
+            'contrast_max': contrast_max * gain,
+        }
+        
+        # Finish each tile and feather it into the output, the weights sum to one
+        output = np.zeros((h, w, 3), dtype=np.float32)
+        for i, ((ty, y0), (tx, x0)) in enumerate(tiles):
+            region = (slice(y0, y0 + len(y_weights[ty])), slice(x0, x0 + len(x_weights[tx])))
+            tile_result = self._finish_region(self._upload(fused[i]),
+                                              [fm[region] for fm in focus_maps],
+                                              ref_stats, (result_min, result_max), sharpen_stats)
+            fused[i] = None
+            output[region] += tile_result * np.outer(y_weights[ty], x_weights[tx])[..., None]
+        
+        return np.clip(output, 0, 1)
+
+    def _reference_stats(self, reference):
+        """
+        Brightness statistics of the reference frame that the blend result is matched to
+        @param reference: Reference image
+        @return: Dict with the overall and per-channel min, max and mean
+        """
+        ref_img = self._upload(reference)
+        stats = {
+            'min': float(cp.min(ref_img)),
+            'max': float(cp.max(ref_img)),
+            'channel_min': cp.min(ref_img, axis=(0, 1)).get(),
+            'channel_max': cp.max(ref_img, axis=(0, 1)).get(),
+            'channel_mean': cp.mean(ref_img, axis=(0, 1)).get(),
+        }
+        del ref_img
+        return stats
+
+    def _fuse_region(self, aligned_images, focus_maps, frame_stats=None, scale=None):
+        """
+        Depth-aware weighted fusion of the frames at processing scale
+        @param aligned_images: Aligned images or tiles of them
+        @param focus_maps: Focus maps with the same size
+        @param frame_stats: Per-frame normalization statistics to use, None computes them over this region
+        @param scale: Upscaling of the region, defaults to scale_factor. Blur sizes
+                      follow it so they cover the same image area.
+        @return: Fused image on the GPU and the per-frame normalization statistics
+        """
+        h, w = aligned_images[0].shape[:2]
+        scale = self.scale_factor if scale is None else scale
+        new_h, new_w = h * scale, w * scale
+        
+        # Per-frame normalization statistics, (count,) arrays keyed by name.
+        # Tiles get those of the whole frame, otherwise they are computed here
+        computed = frame_stats is None
+        if computed:
+            frame_stats = {}
+        
+        def frame_stat(key, frames, reduce, values):
+            """Statistic of every frame in the batch as a (count, 1, 1) GPU array"""
+            if computed:
+                stat = reduce(values, axis=(1, 2), keepdims=True)
+                frame_stats.setdefault(key, np.zeros(len(aligned_images)))[frames] = stat.ravel().get()
+                return stat
+            return cp.asarray(frame_stats[key][frames], dtype=values.dtype)[:, None, None]
+        
+        # Initialize result arrays on GPU
+        result = cp.zeros((new_h, new_w, 3), dtype=cp.float32)
+        weights_sum = cp.zeros((new_h, new_w, 1), dtype=cp.float32)
+        
+        # Process images in batches so every filter launch covers several frames
+        batch_size = self._blend_batch_size(new_h, new_w, len(aligned_images))
+        for start in range(0, len(aligned_images), batch_size):
+            batch_images = aligned_images[start:start + batch_size]
+            batch_maps = focus_maps[start:start + batch_size]
             
-            # Scale image and focus map
-            img_up = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-            fm_up = cv2.resize(fm, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-            
-            # Convert to GPU arrays
-            gpu_img = cp.asarray(img_up)
-            gpu_fm = cp.asarray(fm_up)
-            if len(gpu_fm.shape) == 2:
-                gpu_fm = gpu_fm.reshape(gpu_fm.shape[0], gpu_fm.shape[1], 1)
-            fm_2d = gpu_fm[..., 0] if len(gpu_fm.shape) > 2 else gpu_fm
+            # Scale images and focus maps into (N, H, W, 3) and (N, H, W) stacks.
+            # Focus maps only drive relative weights, so the map filter chain
+            # runs in half precision to halve its memory traffic
+            count = len(batch_images)
+            frames = slice(start, start + count)
+            gpu_imgs = self._scratch_buffer('blend_images', (count, new_h, new_w, 3))
+            fm_2d = self._scratch_buffer('blend_maps', (count, new_h, new_w), cp.float16)
+            fm_upload = self._scratch_buffer('blend_map_upload', (new_h, new_w))
+            img_staging = self._staging_buffer((new_h, new_w, 3))
+            fm_staging = self._staging_buffer((new_h, new_w))
+            for i, (img, fm) in enumerate(zip(batch_images, batch_maps)):
+                # Resize straight into page-locked buffers before uploading
+                cv2.resize(img, (new_w, new_h), dst=img_staging, interpolation=cv2.INTER_LANCZOS4)
+                cv2.resize(fm, (new_w, new_h), dst=fm_staging, interpolation=cv2.INTER_LINEAR)
+                gpu_imgs[i].set(img_staging)
+                fm_upload.set(fm_staging)
+                fm_2d[i] = fm_upload
             
             # Calculate depth gradients on GPU
-            dx = cp.asarray(cv2.Sobel(cp.asnumpy(fm_2d), cv2.CV_32F, 1, 0, ksize=3))
-            dy = cp.asarray(cv2.Sobel(cp.asnumpy(fm_2d), cv2.CV_32F, 0, 1, ksize=3))
-            depth_gradient = cp.sqrt(dx*dx + dy*dy)
+            dx = _sobel(fm_2d, axis=-1)
+            dy = _sobel(fm_2d, axis=-2)
+            depth_gradient = _gradient_magnitude(dx, dy)
             del dx, dy
             
             # Create depth-aware mask (keep bilateral filter for quality)
-            depth_mask = cp.asarray(cv2.bilateralFilter(cp.asnumpy(depth_gradient), 9, 75, 75))
-            depth_mask = (depth_mask - cp.min(depth_mask)) / (cp.max(depth_mask) - cp.min(depth_mask) + 1e-6)
+            depth_mask = _bilateral_filter(depth_gradient, 9, 75, 75,
+                                           out=self._scratch_buffer('depth_mask', fm_2d.shape, cp.float16))
+            mask_min = frame_stat('mask_min', frames, cp.min, depth_mask)
+            mask_max = frame_stat('mask_max', frames, cp.max, depth_mask)
+            depth_mask = (depth_mask - mask_min) / (mask_max - mask_min + 1e-6)
             del depth_gradient
             
             # Multi-scale analysis with GPU memory optimization
@@ -315,22 +871,19 @@ class FocusStacker:
             scales = [200, 150, 100, 50]  # Keep original scales for quality
             weights = [0.35, 0.3, 0.2, 0.15]
             
-            for scale, weight in zip(scales, weights):
-                # Process each scale with minimal GPU-CPU transfers
-                kernel_size = (scale*2+1, scale*2+1)
-                sigma = scale/3
-                
-                # Single GPU transfer for Gaussian blur
-                fm_blur = cp.asarray(cv2.GaussianBlur(cp.asnumpy(fm_2d), kernel_size, sigma))
+            for blur_scale, weight in zip(scales, weights):
+                # Large blurs run at quarter resolution, the full resolution
+                # filter would need hundreds of taps per pixel
+                radius = blur_scale * scale / self.scale_factor
+                fm_blur = _pyramid_blur(fm_2d, int(radius * 2) | 1, radius / 3)
                 
                 # Compute edge strength on GPU
                 edge_strength = cp.abs(fm_2d - fm_blur)
                 edge_strength *= (1.0 + depth_mask)  # Depth-aware edge boost
                 
-                # Local statistics on GPU
-                edge_sq = edge_strength * edge_strength
-                local_std = cp.asarray(cv2.GaussianBlur(cp.asnumpy(edge_sq), (25, 25), 0))
-                threshold = cp.mean(edge_strength) + cp.std(edge_strength) * (2.0 + depth_mask)
+                # Local statistics on GPU, per frame
+                threshold = frame_stat(f'edge_mean_{blur_scale}', frames, cp.mean, edge_strength) + \
+                           frame_stat(f'edge_std_{blur_scale}', frames, cp.std, edge_strength) * (2.0 + depth_mask)
                 
                 # Combine with depth-aware weighting
                 blend_weight = weight * (1.0 + 0.5 * depth_mask)
@@ -339,132 +892,133 @@ class FocusStacker:
                                  fm_2d * blend_weight)
                 
                 # Clean up scale-specific arrays
-                del fm_blur, edge_strength, edge_sq, local_std
+                del fm_blur, edge_strength, threshold, blend_weight
             
-            # Bilateral filtering with minimal transfers
-            smoothed = cp.asarray(cv2.bilateralFilter(cp.asnumpy(fm_new), 11, 100, 100))
-            smoothed = cp.asarray(cv2.bilateralFilter(cp.asnumpy(smoothed), 7, 50, 50))
+            # Bilateral filtering on GPU
+            smoothed = _bilateral_filter(fm_new, 11, 100, 100,
+                                         out=self._scratch_buffer('smooth_wide', fm_2d.shape, cp.float16))
+            smoothed = _bilateral_filter(smoothed, 7, 50, 50,
+                                         out=self._scratch_buffer('smooth_narrow', fm_2d.shape, cp.float16))
             
-            # Normalize and prepare weight
-            weight = (smoothed - cp.min(smoothed)) / (cp.max(smoothed) - cp.min(smoothed) + 1e-6)
-            weight = weight.reshape(weight.shape[0], weight.shape[1], 1)
+            # Normalize and prepare weight, back in float32 for the image blend
+            smoothed = smoothed.astype(cp.float32)
+            smoothed_min = frame_stat('weight_min', frames, cp.min, smoothed)
+            smoothed_max = frame_stat('weight_max', frames, cp.max, smoothed)
+            weight = (smoothed - smoothed_min) / (smoothed_max - smoothed_min + 1e-6)
             
-            # Blend on GPU
-            result += gpu_img * weight
-            weights_sum += weight
+            # Blend the whole batch on GPU
+            gpu_imgs *= weight[..., None]
+            result += cp.sum(gpu_imgs, axis=0)
+            weights_sum += cp.sum(weight, axis=0)[..., None]
             
-            # Clean up image-specific arrays
-            del gpu_img, gpu_fm, fm_2d, fm_new, smoothed, weight, depth_mask
-            cp.get_default_memory_pool().free_all_blocks()
+            # Batch temporaries go back to the memory pool, the scratch buffers
+            # are reused by the next batch
+            del gpu_imgs, fm_2d, fm_new, smoothed, weight, depth_mask
             
         # Normalize result
-        result = result / (weights_sum + 1e-10)
-        
-        # Calculate input statistics and preserve original brightness characteristics
-        ref_img = cp.asarray(aligned_images[0])
-        input_mean = float(cp.mean(ref_img))
-        input_std = float(cp.std(ref_img))
-        max_ref = float(cp.max(ref_img))
+        return result / (weights_sum + 1e-10), frame_stats
+
+    def _finish_region(self, result, focus_maps, ref_stats, result_range, sharpen_stats=None):
+        """
+        Brightness matching and focus-aware sharpening of a fused image
+        @param result: Fused image on the GPU at processing scale
+        @param focus_maps: Focus maps at input size for the same region
+        @param ref_stats: Reference statistics from _reference_stats
+        @param result_range: (min, max) of the fused image to normalize from
+        @param sharpen_stats: Per-channel var_min, var_max and contrast_max of the whole
+                              frame, None computes them over this region
+        @return: Finished image at input size as a NumPy array
+        """
+        new_h, new_w = result.shape[:2]
+        h, w = new_h // self.scale_factor, new_w // self.scale_factor
         
         # Simpler dynamic range preservation that maintains original brightness
-        # Calculate reference statistics
-        ref_min = float(cp.min(ref_img))
-        ref_max = float(cp.max(ref_img))
-        ref_range = ref_max - ref_min
+        max_ref = ref_stats['max']
+        ref_min = ref_stats['min']
+        ref_range = ref_stats['max'] - ref_stats['min']
         
         # Normalize result to match reference range
-        result_min = float(cp.min(result))
-        result_max = float(cp.max(result))
+        result_min, result_max = result_range
         result = (result - result_min) * (ref_range / (result_max - result_min + 1e-6)) + ref_min
         
-        # Apply gentle contrast enhancement
-        for c in range(3):
-            # Calculate channel-specific reference stats
-            channel_min = float(cp.min(ref_img[...,c]))
-            channel_max = float(cp.max(ref_img[...,c]))
-            channel_mean = float(cp.mean(ref_img[...,c]))
-            
-            # Preserve original range while gently enhancing contrast
-            result[...,c] = cp.clip(result[...,c], channel_min, channel_max)
-            # Adjust contrast while maintaining mean
-            result[...,c] = (result[...,c] - channel_mean) * 1.1 + channel_mean
+        # Apply gentle contrast enhancement, channel-specific reference stats
+        # broadcast over all three channels at once
+        channel_min = cp.asarray(ref_stats['channel_min'], dtype=cp.float32)
+        channel_max = cp.asarray(ref_stats['channel_max'], dtype=cp.float32)
+        channel_mean = cp.asarray(ref_stats['channel_mean'], dtype=cp.float32)
+        
+        # Preserve original range while gently enhancing contrast
+        result = cp.clip(result, channel_min, channel_max)
+        # Adjust contrast while maintaining mean
+        result = (result - channel_mean) * 1.1 + channel_mean
             
         # Final range adjustment
         result = cp.clip(result, 0.0, max_ref)
         
-        # Clean up reference image
-        del ref_img
-        
-        # Debug sharpening mask dimensions
-        print(f"\nSharpening mask calculation:")
-        print(f"Result shape: {result.shape}")
-        print(f"Focus mask initial shape: {result[...,0].shape}")
-        
         # Compute focus-aware sharpening mask using resized focus maps
         focus_mask = cp.zeros_like(result[...,0])
-        for i, fm in enumerate(resized_focus_maps):
-            print(f"Processing focus map {i+1}:")
-            print(f"Original shape: {fm.shape}")
+        for fm in focus_maps:
             # Resize focus map to match processing dimensions
-            fm_up = cv2.resize(fm, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-            print(f"Upscaled shape: {fm_up.shape}")
-            gpu_fm = cp.asarray(fm_up)
+            fm_up = cv2.resize(fm, (new_w, new_h), dst=self._staging_buffer((new_h, new_w)),
+                               interpolation=cv2.INTER_LINEAR)
+            gpu_fm = self._upload(fm_up)
             if len(gpu_fm.shape) > 2:
                 gpu_fm = gpu_fm[..., 0]
-            print(f"GPU array shape: {gpu_fm.shape}")
             focus_mask += (1.0 - gpu_fm)
             del gpu_fm, fm_up
             
-        print(f"Final focus mask shape: {focus_mask.shape}")
         focus_mask /= len(focus_maps)
         focus_mask = cp.clip(focus_mask, 0.3, 1.0)
         
-        # Apply sharpening to full image at once
-        sharp_result = cp.zeros_like(result)
-        for c in range(3):
-            # Basic sharpening
-            sharp = cp.real(cp.fft.ifft2(
-                cp.fft.fft2(result[...,c]) * cp.fft.fft2(sharp_kernel, s=result[...,c].shape)
-            ))
-            
-            # High-frequency enhancement
-            high_freq = cp.real(cp.fft.ifft2(
-                cp.fft.fft2(result[...,c]) * cp.fft.fft2(highfreq_kernel, s=result[...,c].shape)
-            ))
-            
-            # Enhanced multi-scale sharpening with extreme detail preservation
-            # Calculate local variance with finer sensitivity
-            local_var = cp.asarray(cv2.GaussianBlur(cp.asnumpy(result[...,c] * result[...,c]), (11, 11), 0)) - \
-                       cp.power(cp.asarray(cv2.GaussianBlur(cp.asnumpy(result[...,c]), (11, 11), 0)), 2)
-            
-            # Enhanced detail mask with stronger edge detection
-            detail_mask = cp.clip((local_var - cp.min(local_var)) / (cp.max(local_var) - cp.min(local_var) + 1e-6), 0.4, 1.0)
-            
-            # Fine detail enhancement
-            fine_detail = cp.real(cp.fft.ifft2(
-                cp.fft.fft2(result[...,c]) * cp.fft.fft2(detail_kernel, s=result[...,c].shape)
-            ))
-            
-            # Adaptive multi-scale sharpening
-            sharp_strength = cp.clip(focus_mask * (1.4 + 0.4 * detail_mask), 0.8, 0.99)
-            
-            # Gentler detail enhancement that preserves original brightness
-            # Calculate local contrast for adaptive sharpening
-            local_contrast = cp.asarray(cv2.Laplacian(cp.asnumpy(result[...,c]), cv2.CV_32F))
-            contrast_mask = cp.clip(cp.abs(local_contrast) / (cp.max(cp.abs(local_contrast)) + 1e-6), 0.2, 0.6)
-            
-            # Combine enhancements with reduced strength
-            sharp_result[...,c] = result[...,c] + \
-                                 sharp * sharp_strength * 0.5 * contrast_mask + \
-                                 high_freq * 0.2 * contrast_mask + \
-                                 fine_detail * 0.1 * contrast_mask  # Minimal enhancement to preserve brightness
-            
-            # Clear intermediate results
-            del sharp, high_freq
-            cp.get_default_memory_pool().free_all_blocks()
+        # Apply sharpening to full image at once. The kernels are tiny, so spatial
+        # convolution is far cheaper than padding them to image size for an FFT.
+        # Every step covers all three channels, reductions are per channel
+        result = cp.ascontiguousarray(result)
+        
+        # Basic sharpening
+        sharp = _convolve_tiled(result, sharp_kernel)
+        
+        # High-frequency enhancement
+        high_freq = _convolve_tiled(result, highfreq_kernel)
+        
+        # Enhanced multi-scale sharpening with extreme detail preservation
+        local_var = self._local_variance(result)
+        
+        # Enhanced detail mask with stronger edge detection
+        if sharpen_stats is not None:
+            var_min = cp.asarray(sharpen_stats['var_min'], dtype=cp.float32)
+            var_max = cp.asarray(sharpen_stats['var_max'], dtype=cp.float32)
+        else:
+            var_min = cp.min(local_var, axis=(0, 1), keepdims=True)
+            var_max = cp.max(local_var, axis=(0, 1), keepdims=True)
+        detail_mask = cp.clip((local_var - var_min) / (var_max - var_min + 1e-6), 0.4, 1.0)
+        del local_var
+        
+        # Fine detail enhancement
+        fine_detail = _convolve_tiled(result, detail_kernel)
+        
+        # Adaptive multi-scale sharpening
+        sharp_strength = cp.clip(focus_mask[..., None] * (1.4 + 0.4 * detail_mask), 0.8, 0.99)
+        del detail_mask
+        
+        # Gentler detail enhancement that preserves original brightness
+        # Calculate local contrast for adaptive sharpening
+        local_contrast = cp.abs(_convolve_tiled(result, laplace_kernel))
+        if sharpen_stats is not None:
+            contrast_max = cp.asarray(sharpen_stats['contrast_max'], dtype=cp.float32)
+        else:
+            contrast_max = cp.max(local_contrast, axis=(0, 1), keepdims=True)
+        contrast_mask = cp.clip(local_contrast / (contrast_max + 1e-6), 0.2, 0.6)
+        del local_contrast
+        
+        # Combine enhancements with reduced strength
+        result = result + \
+                 sharp * sharp_strength * 0.5 * contrast_mask + \
+                 high_freq * 0.2 * contrast_mask + \
+                 fine_detail * 0.1 * contrast_mask  # Minimal enhancement to preserve brightness
         
-        result = sharp_result
-        del sharp_result
+        # Clear intermediate results
+        del sharp, high_freq, fine_detail, sharp_strength, contrast_mask
         
         # Convert back to CPU and downscale if needed
         if self.scale_factor > 1:
@@ -482,42 +1036,75 @@ class FocusStacker:
         
         return result_np
 
+    def _local_variance(self, result):
+        """
+        Per-channel local variance that drives the detail mask
+        @param result: (H, W, 3) image on the GPU
+        @return: Local variance with the same shape
+        """
+        # Calculate local variance with finer sensitivity. The blur helper filters
+        # the last two axes, so it runs on a channel-first view.
+        planes = result.transpose(2, 0, 1)
+        local_var = (_gaussian_blur(planes * planes, 11) -
+                     cp.power(_gaussian_blur(planes, 11), 2)).transpose(1, 2, 0)
+        del planes
+        return local_var
+
+    def _blend_fits_on_gpu(self, height, width):
+        """
+        Whether a whole frame at processing scale can be blended in free GPU memory
+        @param height: Processing height
+        @param width: Processing width
+        """
+        free_bytes, _ = cp.cuda.Device().mem_info
+        free_bytes += cp.get_default_memory_pool().free_bytes()
+        # Accumulators, one frame in flight and the sharpening temporaries,
+        # about 32 float32 values per pixel
+        return height * width * 4 * 32 <= free_bytes
+
+    def _blend_batch_size(self, height, width, count):
+        """
+        Number of frames blended together, bounded by free GPU memory
+        @param height: Processing height
+        @param width: Processing width
+        @param count: Total number of frames
+        """
+        free_bytes, _ = cp.cuda.Device().mem_info
+        free_bytes += cp.get_default_memory_pool().free_bytes()
+        # Scratch buffers from the previous region are reused or replaced
+        free_bytes += sum(buf.nbytes for buf in self._scratch_buffers.values())
+        # Float32 image and weight plus half precision focus map temporaries,
+        # about 32 bytes per pixel
+        frame_bytes = height * width * 32
+        # Keep half of the free memory for the accumulators and sharpening
+        return max(1, min(count, (free_bytes // 2) // frame_bytes))
+
     def split_into_stacks(self, image_paths, stack_size):
-        import re
-        
+        """
+        Group image paths into stacks by their base name
+        @param image_paths: Image paths, already in the desired order (the GUI
+                            natural-sorts them so img_2 comes before img_10)
+        @param stack_size: Expected number of images per stack, used for warnings
+        @return: List of stacks, each keeping the input order of its paths.
+                 Stacks are ordered by their first path in the input.
+        """
         stacks_dict = {}
         for path in image_paths:
             filename = os.path.basename(path)
             name, ext = os.path.splitext(filename)
             
-            patterns = [
-                r'^(.*?)[-_]?(\d+)$',
-                r'^(.*?)[-_]?(\d+)[-_]',
-                r'(\d+)[-_]?(.*?)$'
-            ]
-            
-            matched = False
-            for pattern in patterns:
-                match = re.match(pattern, name)
-                if match:
-                    groups = match.groups()
-                    base_name = groups[0] if len(groups[0]) > len(groups[1]) else groups[1]
-                    if base_name not in stacks_dict:
-                        stacks_dict[base_name] = []
-                    stacks_dict[base_name].append(path)
-                    matched = True
-                    break
-                    
-            if not matched:
+            match = _STACK_RE.match(name)
+            if match:
+                # Only the groups of the alternative that matched are set
+                first, second = [g for g in match.groups() if g is not None]
+                base_name = first if len(first) > len(second) else second
+            else:
                 print(f"Warning: Could not match pattern for file: {filename}")
                 base_name = name
-                if base_name not in stacks_dict:
-                    stacks_dict[base_name] = []
-                stacks_dict[base_name].append(path)
-            
-        for base_name in stacks_dict:
-            stacks_dict[base_name].sort()
+            stacks_dict.setdefault(base_name, []).append(path)
             
+        # No re-sorting here: a lexicographic sort would put img_10 before img_2,
+        # and the first image of a stack is the alignment reference
         stacks = list(stacks_dict.values())
         
         expected_size = stack_size
@@ -526,15 +1113,21 @@ class FocusStacker:
                 print(f"Warning: Stack {i+1} has {len(stack)} images, expected {expected_size}")
                 print(f"Stack contents: {[os.path.basename(p) for p in stack]}")
                 
-        stacks.sort(key=lambda x: x[0])
-        
         print("\nDetected stacks:")
         for i, stack in enumerate(stacks):
             print(f"Stack {i+1}: {[os.path.basename(p) for p in stack]}")
             
         return stacks
 
-    def process_stack(self, image_paths, color_space='sRGB'):
+    def process_stack(self, image_paths, color_space='sRGB', progress_cb=None, should_stop=None):
+        """
+        Load, align and blend one stack of images
+        @param image_paths: Image paths in stack order
+        @param color_space: Output color space
+        @param progress_cb: Optional callable receiving the stack progress (0-100)
+        @param should_stop: Optional callable, processing raises ProcessingStopped once it returns True
+        """
+        check = functools.partial(_checkpoint, progress_cb, should_stop)
         if len(image_paths) < 2:
             raise ValueError("At least 2 images are required")
             
@@ -543,6 +1136,7 @@ class FocusStacker:
             
         images = []
         for i, path in enumerate(image_paths):
+            check(10 * i / len(image_paths))
             print(f"Loading image {i+1}/{len(image_paths)}: {path}")
             try:
                 img = self._load_image(path)
@@ -552,9 +1146,38 @@ class FocusStacker:
                 print(f"Error loading image {path}: {str(e)}")
                 raise
                 
+        return self._process_images(images, color_space, check)
+
+    def process_stack_from_buffers(self, buffers, color_space='sRGB', progress_cb=None, should_stop=None):
+        """
+        Process a stack whose files were already read into memory
+        @param buffers: Encoded image files as bytes, in stack order
+        @param color_space: Output color space
+        @param progress_cb: Optional callable receiving the stack progress (0-100)
+        @param should_stop: Optional callable, processing raises ProcessingStopped once it returns True
+        """
+        check = functools.partial(_checkpoint, progress_cb, should_stop)
+        if len(buffers) < 2:
+            raise ValueError("At least 2 images are required")
+            
+        print(f"\nProcessing stack of {len(buffers)} preloaded images...")
+        # OpenCV releases the GIL while decoding, so files decode in parallel
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            images = list(pool.map(self._decode_image, buffers))
+        print(f"Decoded {len(images)} images with shape {images[0].shape}")
+        
+        return self._process_images(images, color_space, check)
+
+    def _process_images(self, images, color_space, check):
+        """
+        Align, measure focus and blend loaded images
+        @param images: Float32 RGB images
+        @param color_space: Output color space
+        @param check: Called with the stack progress (0-100) at every step, see _checkpoint
+        """
         print("\nAligning images...")
         try:
-            aligned = self._align_images(images)
+            aligned = self._align_images(images, lambda done: check(10 + 30 * done))
             print(f"Successfully aligned {len(aligned)} images")
         except Exception as e:
             print(f"Error during image alignment: {str(e)}")
@@ -562,16 +1185,27 @@ class FocusStacker:
             
         print("\nCalculating focus measures...")
         focus_maps = []
-        for i, img in enumerate(aligned):
+        # Upload the next frame on the copy stream while the current focus
+        # measure runs on the compute stream
+        pending = self._upload_gray_async(aligned[0], slot=0)
+        for i in range(len(aligned)):
+            check(40 + 30 * i / len(aligned))
             print(f"Computing focus measure for image {i+1}/{len(aligned)}")
             try:
-                focus_map = self._focus_measure(img)
-                focus_maps.append(focus_map)
+                gpu_gray, ready = pending
+                self.stream_compute.wait_event(ready)
+                with self.stream_compute:
+                    gpu_map = self._focus_measure_gpu(gpu_gray)
+                if i + 1 < len(aligned):
+                    pending = self._upload_gray_async(aligned[i + 1], slot=(i + 1) % 2)
+                focus_maps.append(cp.asnumpy(gpu_map, stream=self.stream_compute))
+                del gpu_gray, gpu_map
                 print(f"Focus measure computed for image {i+1}")
             except Exception as e:
                 print(f"Error calculating focus measure for image {i+1}: {str(e)}")
                 raise
                 
+        check(70)
         print("\nBlending images...")
         try:
             result = self._blend_images(aligned, focus_maps)
@@ -580,6 +1214,7 @@ class FocusStacker:
             print(f"Error during image blending: {str(e)}")
             raise
             
+        check(95)
         if color_space != 'sRGB':
             print(f"\nConverting to {color_space} color space...")
             try:
@@ -589,9 +1224,75 @@ class FocusStacker:
                 print(f"Error during color space conversion: {str(e)}")
                 raise
             
+        # Staging and scratch buffers are released to the host and the device
+        self._staging_buffers.clear()
+        self._scratch_buffers.clear()
+        cp.get_default_memory_pool().free_all_blocks()
+        cp.get_default_pinned_memory_pool().free_all_blocks()
+            
         print("\nStack processing complete!")
+        check(100)
         return result
 
+    @staticmethod
+    def default_workers():
+        """
+        One worker per GPU, or two sharing a single GPU so I/O overlaps compute.
+        Every worker holds its own CUDA context and full-frame buffers, so the
+        count follows the GPUs rather than the CPU cores.
+        """
+        gpu_count = cp.cuda.runtime.getDeviceCount()
+        return gpu_count if gpu_count > 1 else 2
+
+    def create_executor(self, max_workers=None, progress_queue=None, stop_event=None):
+        """
+        Process pool whose workers each hold a FocusStacker with this stacker's
+        parameters and their own CUDA context
+        @param max_workers: Worker processes, defaults to one per GPU or two on a single GPU
+        @param progress_queue: Optional shared queue receiving (tag, progress) from running stacks
+        @param stop_event: Optional shared event, running stacks stop once it is set
+        @return: ProcessPoolExecutor to pass to submit_buffers
+        """
+        if max_workers is None:
+            max_workers = self.default_workers()
+        
+        # CUDA does not survive fork, so workers are spawned. The counter hands
+        # each worker a rank that picks its device.
+        context = multiprocessing.get_context('spawn')
+        counter = context.Value('i', 0)
+        params = {
+            'radius': self.radius,
+            'smoothing': self.smoothing,
+            'scale_factor': self.scale_factor,
+        }
+        return ProcessPoolExecutor(max_workers=max(1, max_workers), mp_context=context,
+                                   initializer=_init_worker,
+                                   initargs=(counter, params, progress_queue, stop_event))
+
+    def submit_buffers(self, executor, buffers, color_space='sRGB', tag=None):
+        """
+        Queue one stack of preloaded files on an executor from create_executor
+        @param tag: Identifies the stack in the progress queue
+        @return: Future resolving to the process_stack_from_buffers result
+        """
+        return executor.submit(_process_buffers_worker, buffers, color_space, tag)
+
+    def process_stacks(self, stacks, color_space='sRGB', max_workers=None):
+        """
+        Process several stacks in parallel worker processes, each with its own
+        CUDA context, so loading and alignment of one stack overlap with GPU
+        work on another
+        @param stacks: List of image path lists, e.g. from split_into_stacks
+        @param color_space: Color space passed to process_stack
+        @param max_workers: Worker processes, defaults to one per GPU or two on a single GPU
+        @return: Results in the order of the stacks
+        """
+        max_workers = max(1, min(max_workers or self.default_workers(), len(stacks)))
+        print(f"\nProcessing {len(stacks)} stacks with {max_workers} worker processes...")
+        with self.create_executor(max_workers) as executor:
+            return list(executor.map(_process_stack_worker, stacks,
+                                     itertools.repeat(color_space)))
+
     def _convert_color_space(self, img, target_space):
         pil_img = PIL.Image.fromarray((img * 255).astype('uint8'))
         
@@ -632,3 +1333,69 @@ class FocusStacker:
         except Exception as e:
             print(f"Error saving image: {str(e)}")
             raise
+
+# Per-process stacker and shared progress/stop channels used by process_stacks workers
+_worker_stacker = None
+_worker_progress = None
+_worker_stop = None
+
+def _lower_priority():
+    """
+    Run worker processes below the GUI process so the Qt event loop keeps
+    its cadence while every core is busy with stacks
+    """
+    try:
+        if hasattr(os, 'nice'):
+            os.nice(5)
+        elif os.name == 'nt':
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+    except OSError as e:
+        print(f"Could not lower worker priority: {str(e)}")
+
+def _init_worker(counter, params, progress_queue=None, stop_event=None):
+    """
+    Bind a worker process to a GPU and create its FocusStacker
+    @param counter: Shared multiprocessing.Value handing out worker ranks
+    @param params: FocusStacker constructor arguments
+    @param progress_queue: Shared queue for (tag, progress) updates, or None
+    @param stop_event: Shared event asking running stacks to stop, or None
+    """
+    global _worker_stacker, _worker_progress, _worker_stop
+    _lower_priority()
+    _worker_progress = progress_queue
+    _worker_stop = stop_event
+    with counter.get_lock():
+        rank = counter.value
+        counter.value += 1
+    # Round-robin over the GPUs, workers sharing a device get their own streams
+    device = rank % cp.cuda.runtime.getDeviceCount()
+    cp.cuda.Device(device).use()
+    _worker_stacker = FocusStacker(**params)
+    print(f"Worker {rank} using GPU {device}")
+
+def _worker_callbacks(tag):
+    """
+    progress_cb and should_stop for a stack running in a worker process
+    """
+    progress_cb = None
+    if _worker_progress is not None:
+        progress_cb = lambda percent: _worker_progress.put((tag, percent))
+    should_stop = _worker_stop.is_set if _worker_stop is not None else None
+    return progress_cb, should_stop
+
+def _process_stack_worker(image_paths, color_space, tag=None):
+    """
+    Process one stack with the worker's FocusStacker
+    """
+    progress_cb, should_stop = _worker_callbacks(tag)
+    return _worker_stacker.process_stack(image_paths, color_space, progress_cb, should_stop)
+
+def _process_buffers_worker(buffers, color_space, tag=None):
+    """
+    Process one stack of preloaded files with the worker's FocusStacker
+    """
+    progress_cb, should_stop = _worker_callbacks(tag)
+    return _worker_stacker.process_stack_from_buffers(buffers, color_space, progress_cb, should_stop)
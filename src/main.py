@@ -1,52 +1,134 @@
 #!/usr/bin/env python3
 
+import logging
+import multiprocessing
 import os
+import queue
+import re
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QPushButton, QLabel, QFileDialog, 
                             QComboBox, QProgressBar, QMessageBox, QGroupBox,
                             QGridLayout, QCheckBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import (Qt, QTimer, QObject, QRunnable, QThreadPool, QMutex,
+                          pyqtSignal)
 from focus_stacker import FocusStacker
 
-class FocusStackingThread(QThread):
+logger = logging.getLogger(__name__)
+
+# Trailing frame number of a filename stem
+_STEM_RE = re.compile(r'(\d+)$')
+
+def _parse_stem(path):
+    """
+    Split a filename into its base name and trailing frame number
+    @param path Image path
+    @return (base name, number), or None if the name has no trailing number
+    """
+    # Get filename without extension
+    name = os.path.basename(path)
+    dot = name.rfind('.')
+    filename = name[:dot] if dot > 0 and name[:dot].lstrip('.') else name
+    # Find last number in filename, the base name keeps at least one character
+    match = _STEM_RE.search(filename)
+    if match:
+        start = max(match.start(), 1)
+        if start < len(filename):
+            # Everything before the last number and the last number
+            return filename[:start], int(filename[start:])
+    return None
+
+def _natural_key(path, stem):
     """
-    @class FocusStackingThread
-    @brief Thread for processing focus stacking to keep UI responsive
+    Sort key ordering frame numbers numerically within each directory and base name
+    @param path Image path
+    @param stem Result of _parse_stem for the path
     """
-    progress = pyqtSignal(int)
-    finished = pyqtSignal(object)
+    if stem is None:
+        return (os.path.dirname(path), os.path.basename(path), -1)
+    return (os.path.dirname(path), stem[0], stem[1])
+
+def _read_file(path):
+    """
+    Read a whole image file
+    @param path Image path
+    @return File contents as bytes
+    """
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _warm_pagecache(paths):
+    """
+    Ask the OS to read files ahead so a queued stack loads from the page cache
+    @param paths Image paths of the stack
+    """
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                else:
+                    # No readahead hint (e.g. Windows), reading the file warms the cache
+                    while f.read(1 << 16):
+                        pass
+        except OSError as e:
+            logger.debug("Prefetch of %s failed: %s", path, e)
+
+class _SaveSignals(QObject):
+    """
+    @class _SaveSignals
+    @brief Signals for _SaveTask, QRunnable cannot emit signals itself
+    """
+    saved = pyqtSignal(int)
     error = pyqtSignal(str)
 
-    def __init__(self, stacker, image_paths, color_space):
+class _SaveTask(QRunnable):
+    """
+    @class _SaveTask
+    @brief Encodes and writes one stack result on the thread pool so the next
+           stack's results are not held up by JPEG encoding and disk I/O
+    """
+    def __init__(self, stacker, result, output_path, fmt, color_space, index,
+                 signals, on_saved):
         """
-        @param stacker FocusStacker instance
-        @param image_paths List of paths to images
+        @param stacker FocusStacker used to save the image
+        @param result Processed image
+        @param output_path Destination file path
+        @param fmt Image format
         @param color_space Selected color space
+        @param index Index of the stack the result belongs to
+        @param signals _SaveSignals reporting back to the UI thread
+        @param on_saved Callback counting completed saves, runs on the pool thread
         """
         super().__init__()
         self.stacker = stacker
-        self.image_paths = image_paths
+        self.result = result
+        self.output_path = output_path
+        self.fmt = fmt
         self.color_space = color_space
-        self.stopped = False
+        self.index = index
+        self.signals = signals
+        self.on_saved = on_saved
 
     def run(self):
-        """Process the focus stacking operation"""
+        """Save the image and report the outcome"""
         try:
-            result = self.stacker.process_stack(
-                self.image_paths, 
+            self.stacker.save_image(
+                self.result,
+                self.output_path,
+                self.fmt,
                 self.color_space
             )
-            if not self.stopped:
-                self.finished.emit(result)
+            self.on_saved()
+            self.signals.saved.emit(self.index)
         except Exception as e:
-            if not self.stopped:
-                self.error.emit(str(e))
-
-    def stop(self):
-        """Signal the thread to stop processing"""
-        self.stopped = True
+            self.signals.error.emit(f'Failed to save image: {str(e)}')
+        finally:
+            self.result = None
 
 class MainWindow(QMainWindow):
     """
@@ -56,6 +138,34 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.image_paths = []
+        self.params_pending = False
+        self.executor = None
+        self.futures = {}
+        self.pending_reads = {}
+        self.stack_progress = {}
+        # Shared progress queue for the worker processes, created with the
+        # first run. Every run gets its own stop event and id.
+        self._manager = None
+        self.stop_event = None
+        self.run_id = 0
+        
+        # Completed stacks are collected by polling their futures
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(100)
+        self.poll_timer.timeout.connect(self._poll_futures)
+        
+        # Reads the stack after the submitted ones into the page cache
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=2)
+        # Reads the files of a stack in parallel before it is submitted
+        self._read_pool = ThreadPoolExecutor(max_workers=4)
+        
+        # Results are saved on the thread pool while the next stacks compute
+        self.save_pool = QThreadPool.globalInstance()
+        self.save_mutex = QMutex()
+        self.saved_stacks = 0
+        self.save_signals = _SaveSignals()
+        self.save_signals.saved.connect(self.stack_saved)
+        self.save_signals.error.connect(self.save_failed)
         
         # Default stacking parameters optimized for photogrammetry
         self.radius = 2      # Minimum radius for maximum micro-detail preservation
@@ -191,61 +301,54 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.status_label)
 
     def update_stacker(self):
+        """Schedule a parameter update, changes within 50 ms are applied together"""
+        if not self.params_pending:
+            self.params_pending = True
+            QTimer.singleShot(50, self._apply_params)
+
+    def _apply_params(self):
         """Update stacker with current parameter values"""
+        self.params_pending = False
         self.radius = int(self.radius_combo.currentText())
         self.smoothing = int(self.smoothing_combo.currentText())
         
         self.scale = int(self.scale_combo.currentText().replace('x', ''))
-        self.stacker = FocusStacker(
-            radius=self.radius,
-            smoothing=self.smoothing,
-            scale_factor=self.scale
-        )
+        self.stacker.set_params(self.radius, self.smoothing, self.scale)
 
-    def detect_stack_size(self, image_paths):
+    def detect_stack_size(self, image_paths, stems=None):
         """
         Detect stack size by finding sequences in filenames
         @param image_paths List of image paths
+        @param stems Optional (base name, number) per path from _parse_stem
         @return Number of images per stack
         """
-        import re
-        
-        # Group files by their base name (everything before the last number)
-        stacks = {}
-        for path in image_paths:
-            # Get filename without extension
-            filename = os.path.splitext(os.path.basename(path))[0]
-            # Find last number in filename
-            match = re.search(r'^(.+?)(\d+)$', filename)
-            if match:
-                base_name = match.group(1)  # Everything before the last number
-                number = int(match.group(2))  # The last number
-                if base_name not in stacks:
-                    stacks[base_name] = []
-                stacks[base_name].append(number)
+        if stems is None:
+            stems = [_parse_stem(path) for path in image_paths]
         
-        if not stacks:
-            print("Warning: No numbered sequences found in filenames")
+        # Base name (everything before the last number) of every numbered file
+        bases = np.array([stem[0] for stem in stems if stem is not None])
+        if bases.size == 0:
+            logger.warning("No numbered sequences found in filenames")
             return len(image_paths)  # Treat all images as one stack
             
-        # Sort numbers in each stack
-        for numbers in stacks.values():
-            numbers.sort()
-            
-        # Verify sequences are continuous
-        for base_name, numbers in stacks.items():
-            expected = list(range(min(numbers), max(numbers) + 1))
-            if numbers != expected:
-                print(f"Warning: Non-continuous sequence for {base_name}: {numbers}")
+        # Files per base name, then the most common of those sizes
+        _, sizes = np.unique(bases, return_counts=True)
+        
+        # Verify sequences are continuous, only needed to explain uneven stacks
+        if logger.isEnabledFor(logging.DEBUG) or sizes.min() != sizes.max():
+            stacks = defaultdict(list)
+            for stem in stems:
+                if stem is not None:
+                    stacks[stem[0]].append(stem[1])
+            for base_name, numbers in stacks.items():
+                numbers.sort()
+                expected = list(range(numbers[0], numbers[-1] + 1))
+                if numbers != expected:
+                    logger.warning("Non-continuous sequence for %s: %s", base_name, numbers)
                 
-        # Find most common stack size
-        sizes = [len(numbers) for numbers in stacks.values()]
-        if sizes:
-            size = max(set(sizes), key=sizes.count)  # Most common size
-            print(f"Detected stack size: {size}")
-            return size
-            
-        return len(image_paths)  # Default to all images as one stack
+        size = int(np.bincount(sizes)[1:].argmax()) + 1  # Most common size
+        logger.info("Detected stack size: %d", size)
+        return size
 
     def load_images(self):
         """Open file dialog to select images"""
@@ -254,15 +357,19 @@ class MainWindow(QMainWindow):
         file_dialog.setNameFilter("Images (*.png *.jpg *.jpeg *.tif *.tiff)")
         
         if file_dialog.exec_():
-            self.image_paths = sorted(file_dialog.selectedFiles())  # Sort for consistent order
-            print("\nLoaded images:", self.image_paths)
+            # Natural sort so img2 comes before img10, parsing each name once
+            stems = {path: _parse_stem(path) for path in file_dialog.selectedFiles()}
+            self.image_paths = sorted(stems, key=lambda path: (_natural_key(path, stems[path]), path))
+            stems = [stems[path] for path in self.image_paths]
+            logger.debug("Loaded images: %s", self.image_paths)
             
-            stack_size = self.detect_stack_size(self.image_paths)
+            stack_size = self.detect_stack_size(self.image_paths, stems)
             self.stacks = self.stacker.split_into_stacks(self.image_paths, stack_size)
             
-            print(f"\nSplit into {len(self.stacks)} stacks of size {stack_size}")
-            for i, stack in enumerate(self.stacks):
-                print(f"Stack {i+1}:", stack)
+            logger.info("Split into %d stacks of size %d", len(self.stacks), stack_size)
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, stack in enumerate(self.stacks):
+                    logger.debug("Stack %d: %s", i + 1, stack)
                 
             self.status_label.setText(f'Loaded {len(self.image_paths)} images in {len(self.stacks)} stacks')
 
@@ -272,122 +379,242 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, 'Error', 'Please load images first')
             return
 
+        # A new run replaces a running one, whose stacks stop at their next checkpoint
+        self._shutdown_executor()
+
+        # Apply a parameter change that is still waiting for its debounce timer
+        if self.params_pending:
+            self._apply_params()
+
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
         self.current_stack = 0
-        self.results = []
+        self.results_count = 0
+        self.saved_stacks = 0
+        
+        # One output directory check and one timestamp for the whole batch
+        self._output_dir = 'output'
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._run_timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         self.stop_btn.setEnabled(True)
         
-        # Process first stack
+        # Stacks are independent, so they run in worker processes. Each worker
+        # holds a CUDA context and full-frame GPU buffers, so the pool is sized
+        # by GPU count (see FocusStacker.default_workers) rather than CPU cores.
+        if self._manager is None:
+            self._manager = multiprocessing.get_context('spawn').Manager()
+            self.progress_queue = self._manager.Queue()
+        # Stacks of a stopped run may still be heading for their next checkpoint.
+        # A fresh event keeps them stopped, the run id tells their progress apart.
+        self.stop_event = self._manager.Event()
+        self.run_id += 1
+        self.max_in_flight = min(self.stacker.default_workers(), len(self.stacks))
+        self.executor = self.stacker.create_executor(self.max_in_flight,
+                                                     self.progress_queue,
+                                                     self.stop_event)
+        self.futures = {}
+        self.pending_reads = {}
+        self.stack_progress = {}
+        
+        # Start reading the first stacks, they are submitted once their files are in memory
         self._process_next_stack()
+        if self.executor is not None:
+            self.poll_timer.start()
 
     def stop_processing(self):
         """Stop the current processing operation"""
-        if hasattr(self, 'thread') and self.thread.isRunning():
-            print("\nStopping processing...")
-            self.thread.stop()  # Signal thread to stop
-            self.thread.wait()  # Wait for thread to finish
+        if self.executor is not None:
+            logger.info("Stopping processing...")
+            self._shutdown_executor()
             
             # Reset UI
             self.progress_bar.setVisible(False)
             self.stop_btn.setEnabled(False)
             self.status_label.setText('Processing stopped')
-            print("Processing stopped")
+            logger.info("Processing stopped")
+
+    def _shutdown_executor(self):
+        """Stop polling and drop queued stacks, running ones finish in the background"""
+        if self.executor is None:
+            return
+        # Running stacks stop at their next image instead of finishing
+        self.stop_event.set()
+        self.poll_timer.stop()
+        for reads in self.pending_reads.values():
+            for read in reads:
+                read.cancel()
+        self.pending_reads = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.futures = {}
 
     def _process_next_stack(self):
-        """Process the next stack in the queue"""
-        if self.current_stack >= len(self.stacks):
-            print("\nAll stacks processed!")
-            self.processing_all_finished()
+        """Start reading queued stacks until every worker has one in flight"""
+        if self.executor is None:
             return
+        while (self.current_stack < len(self.stacks) and
+               len(self.futures) + len(self.pending_reads) < self.max_in_flight):
+            logger.debug("Reading stack %d/%d with %d images",
+                         self.current_stack + 1, len(self.stacks),
+                         len(self.stacks[self.current_stack]))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Stack images: %s", self.stacks[self.current_stack])
             
-        # Calculate overall progress
-        overall_progress = (self.current_stack * 100) // len(self.stacks)
-        self.progress_bar.setValue(overall_progress)
-        
-        print(f"\n=== Processing stack {self.current_stack + 1}/{len(self.stacks)} ===")
-        print(f"Stack contains {len(self.stacks[self.current_stack])} images")
-        print("Stack images:", self.stacks[self.current_stack])
-        
-        # Create and start processing thread
-        self.thread = FocusStackingThread(
-            self.stacker,
-            self.stacks[self.current_stack],
-            self.color_combo.currentText()
-        )
-        self.thread.progress.connect(lambda p: self.update_stack_progress(p, overall_progress))
-        self.thread.finished.connect(self.processing_one_finished)
-        self.thread.error.connect(self.processing_error)
-        self.thread.start()
-
-    def update_stack_progress(self, stack_progress, overall_base):
-        """Update progress bar with combined progress
-        @param stack_progress Progress of current stack (0-100)
-        @param overall_base Base progress from completed stacks
+            # Workers get the encoded files and decode them from memory. The files
+            # are read in parallel off the UI thread, _submit_ready_reads hands
+            # the stack to the executor once all of them are in memory.
+            self.pending_reads[self.current_stack] = [
+                self._read_pool.submit(_read_file, path)
+                for path in self.stacks[self.current_stack]
+            ]
+            self.current_stack += 1
+            
+            # Warm the next stack's files while this one computes
+            if self.current_stack < len(self.stacks):
+                self._prefetch_pool.submit(_warm_pagecache, self.stacks[self.current_stack])
+
+    def _submit_ready_reads(self):
+        """Submit every stack whose files have been read to the executor"""
+        for index in [i for i, reads in self.pending_reads.items() if all(r.done() for r in reads)]:
+            reads = self.pending_reads.pop(index)
+            try:
+                buffers = [read.result() for read in reads]
+            except Exception as e:
+                self.processing_error(f'Failed to read images: {str(e)}')
+                return
+            logger.debug("Processing stack %d/%d", index + 1, len(self.stacks))
+            # A dead worker breaks the pool, submit raises BrokenProcessPool
+            try:
+                future = self.stacker.submit_buffers(
+                    self.executor,
+                    buffers,
+                    self.color_combo.currentText(),
+                    tag=(self.run_id, index)
+                )
+            except Exception as e:
+                self.processing_error(str(e))
+                return
+            del buffers, reads
+            self.futures[future] = index
+
+    def _poll_futures(self):
+        """Hand finished stacks to the UI and keep the workers busy"""
+        # Progress reported by the running stacks
+        while True:
+            try:
+                tag, stack_progress = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.update_stack_progress(tag, stack_progress)
+            
+        for future in [f for f in self.futures if f.done()]:
+            index = self.futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.processing_error(str(e))
+                return
+            self.processing_one_finished(index, result)
+            
+        # One progress bar update per poll, however many messages arrived. The
+        # 100 ms poll interval is the rate limit for repaints.
+        self._show_progress()
+        self._submit_ready_reads()
+        self._process_next_stack()
+        if self.executor is not None and not self.futures and not self.pending_reads:
+            logger.debug("All stacks processed")
+            self.processing_all_finished()
+
+    def update_stack_progress(self, tag, stack_progress):
+        """Record the progress of a running stack, shown with the next _show_progress
+        @param tag (run id, stack index) the stack was submitted with
+        @param stack_progress Progress of that stack (0-100)
         """
-        # Scale stack progress to portion of total progress
-        stack_portion = stack_progress / len(self.stacks)
-        total_progress = overall_base + stack_portion
+        run_id, index = tag
+        # Ignore stacks from a stopped run that have not reached a checkpoint yet
+        if run_id == self.run_id and index in self.futures.values():
+            self.stack_progress[index] = stack_progress
+
+    def _show_progress(self):
+        """Completed stacks plus the partial progress of the running ones"""
+        total_progress = (self.results_count * 100 + sum(self.stack_progress.values())) / len(self.stacks)
         self.progress_bar.setValue(int(total_progress))
 
-    def processing_one_finished(self, result):
+    def processing_one_finished(self, index, result):
         """Handle completion of one stack
-        @param result Processed image
+        @param index Index of the stack in self.stacks
+        @param result Processed image, ownership passes to the save task
         """
-        print(f"\n=== Saving result for stack {self.current_stack + 1} ===")
-        
         # Save intermediate result
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'stack_{self.current_stack + 1}of{len(self.stacks)}_{timestamp}'
-        ext = '.jpg'
-            
-        output_path = os.path.join('output', filename + ext)
-        print(f"Creating output directory...")
-        os.makedirs('output', exist_ok=True)
-        print(f"Saving to: {output_path}")
+        output_path = f'{self._output_dir}/stack_{index + 1}of{len(self.stacks)}_{self._run_timestamp}.jpg'
+        logger.debug("Saving stack %d to %s", index + 1, output_path)
         
-        try:
-            print(f"Saving image with format JPEG and color space {self.color_combo.currentText()}")
-            self.stacker.save_image(
-                result,
-                output_path,
-                'JPEG',
-                self.color_combo.currentText()
-            ) 
-            print(f"Successfully saved stack result")
-            self.results.append(result)
-            status_text = f'Completed stack {self.current_stack + 1} of {len(self.stacks)}'
-            print(status_text)
-            self.status_label.setText(status_text)
-        except Exception as e:
-            error_msg = f'Failed to save image: {str(e)}'
-            print(f"ERROR: {error_msg}")
-            QMessageBox.critical(self, 'Error', error_msg)
+        self.save_pool.start(_SaveTask(
+            self.stacker,
+            result,
+            output_path,
+            'JPEG',
+            self.color_combo.currentText(),
+            index,
+            self.save_signals,
+            self._count_saved
+        ))
+        # Only the count is kept, the image is freed once it is saved
+        del result
             
-        # Process next stack
-        self.current_stack += 1
-        self._process_next_stack()
+        # Stacks finish out of order, progress counts completions
+        self.stack_progress.pop(index, None)
+        self.results_count += 1
+
+    def _count_saved(self):
+        """Count a completed save, called from the save pool threads"""
+        self.save_mutex.lock()
+        self.saved_stacks += 1
+        self.save_mutex.unlock()
+
+    def stack_saved(self, index):
+        """Handle a stack result written to disk
+        @param index Index of the saved stack
+        """
+        status_text = f'Completed stack {index + 1} of {len(self.stacks)}'
+        logger.debug(status_text)
+        self.status_label.setText(status_text)
+
+    def save_failed(self, error_msg):
+        """Handle a failed save
+        @param error_msg Error message to display
+        """
+        logger.error(error_msg)
+        QMessageBox.critical(self, 'Error', error_msg)
 
     def processing_all_finished(self):
         """Handle completion of all stacks"""
-        print("\n=== All Processing Complete ===")
-        print(f"Total stacks processed: {len(self.results)}")
+        # The last results may still be encoding
+        self.save_pool.waitForDone()
+        self.save_mutex.lock()
+        saved_stacks = self.saved_stacks
+        self.save_mutex.unlock()
+        logger.info("All processing complete, %d stacks processed, %d saved",
+                    self.results_count, saved_stacks)
+        self._shutdown_executor()
         self.progress_bar.setVisible(False)
         self.stop_btn.setEnabled(False)
-        status_text = f'Processing complete - {len(self.results)} stacks processed'
-        print(status_text)
+        status_text = f'Processing complete - {self.results_count} stacks processed'
         self.status_label.setText(status_text)
 
     def processing_error(self, error_msg):
         """Handle processing errors
         @param error_msg Error message to display
         """
+        logger.error("Processing failed: %s", error_msg)
+        self._shutdown_executor()
         QMessageBox.critical(self, 'Error', f'Processing failed: {error_msg}')
         self.progress_bar.setVisible(False)
         self.stop_btn.setEnabled(False)
         self.status_label.setText('Processing failed')
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+def tile_starts(length, tile, overlap):
+    """
+    Start offsets of tiles covering an axis, the last tile is aligned to the end
+    @param length: Axis length
+    @param tile: Tile size
+    @param overlap: Minimum overlap between neighbouring tiles
+    @return: List of start offsets
+    """
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, tile - overlap)) + [length - tile]
+
+def tile_weights(starts, length, tile, overlap):
+    """
+    1D feather weights of the tiles along an axis. Each tile ramps up with a
+    cosine where its predecessor ramps down, so the weights sum to one at every
+    pixel, including the end-aligned last tile with its wider overlap.
+    @param starts: Tile start offsets from tile_starts
+    @param length: Axis length
+    @param tile: Tile size
+    @param overlap: Ramp length, at most half the tile size
+    @return: List of float32 weights, one array per tile
+    """
+    ramp = 0.5 - 0.5 * np.cos(np.pi * (np.arange(overlap, dtype=np.float32) + 0.5) / overlap)
+    weights = []
+    for k, start in enumerate(starts):
+        end = min(start + tile, length)
+        w = np.ones(end - start, dtype=np.float32)
+        if k > 0:
+            # The previous tile keeps the pixels before its ramp down
+            ramp_at = min(starts[k - 1] + tile, length) - overlap - start
+            w[:ramp_at] = 0
+            w[ramp_at:ramp_at + overlap] = ramp
+        if k < len(starts) - 1:
+            w[-overlap:] = ramp[::-1]
+        weights.append(w)
+    return weights
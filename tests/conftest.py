@@ -0,0 +1,27 @@
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+@pytest.fixture(scope='session')
+def main_module():
+    """The GUI module, imported without CUDA: its filename helpers never touch the stacker"""
+    pytest.importorskip('PyQt5.QtWidgets')
+    if 'main' in sys.modules:
+        return sys.modules['main']
+    try:
+        importlib.import_module('focus_stacker')
+    except Exception:
+        # No GPU stack here, main only needs the FocusStacker name at import time.
+        # The stand-in is removed again so other tests still skip on focus_stacker.
+        sys.modules['focus_stacker'] = types.SimpleNamespace(FocusStacker=None)
+        try:
+            return importlib.import_module('main')
+        finally:
+            del sys.modules['focus_stacker']
+    return importlib.import_module('main')
@@ -0,0 +1,32 @@
+def _detect(main_module, paths):
+    # detect_stack_size uses no window state
+    return main_module.MainWindow.detect_stack_size(None, paths)
+
+
+def test_detect_stack_size_counts_files_per_base(main_module):
+    paths = [f'/data/{base}_{i}.jpg' for base in ('a', 'b', 'c') for i in range(1, 6)]
+    assert _detect(main_module, paths) == 5
+
+
+def test_detect_stack_size_takes_most_common_size(main_module):
+    paths = ([f'/data/a_{i}.jpg' for i in range(4)] +
+             [f'/data/b_{i}.jpg' for i in range(4)] +
+             [f'/data/c_{i}.jpg' for i in range(7)])
+    assert _detect(main_module, paths) == 4
+
+
+def test_detect_stack_size_tie_goes_to_smaller_size(main_module):
+    paths = ([f'/data/a_{i}.jpg' for i in range(6)] +
+             [f'/data/b_{i}.jpg' for i in range(3)])
+    assert _detect(main_module, paths) == 3
+
+
+def test_detect_stack_size_without_numbers_is_one_stack(main_module):
+    paths = ['/data/left.jpg', '/data/right.jpg', '/data/center.jpg']
+    assert _detect(main_module, paths) == 3
+
+
+def test_detect_stack_size_uses_given_stems(main_module):
+    paths = ['/data/x.jpg', '/data/y.jpg', '/data/z.jpg', '/data/w.jpg']
+    stems = [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+    assert main_module.MainWindow.detect_stack_size(None, paths, stems) == 2
@@ -0,0 +1,26 @@
+def test_parse_stem_splits_trailing_number(main_module):
+    assert main_module._parse_stem('/data/img_0012.jpg') == ('img_', 12)
+    assert main_module._parse_stem('/data/IMG12.tif') == ('IMG', 12)
+
+
+def test_parse_stem_keeps_one_base_character(main_module):
+    # A name that is only a number keeps its first digit as the base name
+    assert main_module._parse_stem('/data/1234.png') == ('1', 234)
+    assert main_module._parse_stem('/data/7.png') is None
+
+
+def test_parse_stem_without_number(main_module):
+    assert main_module._parse_stem('/data/reference.jpg') is None
+    assert main_module._parse_stem('/data/.hidden12') == ('.hidden', 12)
+
+
+def test_natural_key_orders_numbers_numerically(main_module):
+    paths = ['/data/img10.jpg', '/data/img2.jpg', '/data/img1.jpg', '/data/notes.jpg']
+    ordered = sorted(paths, key=lambda p: (main_module._natural_key(p, main_module._parse_stem(p)), p))
+    assert ordered == ['/data/img1.jpg', '/data/img2.jpg', '/data/img10.jpg', '/data/notes.jpg']
+
+
+def test_natural_key_groups_by_directory_and_base(main_module):
+    paths = ['/b/img1.jpg', '/a/shot2.jpg', '/a/img11.jpg', '/a/img3.jpg']
+    ordered = sorted(paths, key=lambda p: (main_module._natural_key(p, main_module._parse_stem(p)), p))
+    assert ordered == ['/a/img3.jpg', '/a/img11.jpg', '/a/shot2.jpg', '/b/img1.jpg']
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+focus_stacker = pytest.importorskip('focus_stacker')
+
+
+def _stacker():
+    # split_into_stacks uses no GPU state, so skip __init__ and its CUDA streams
+    return object.__new__(focus_stacker.FocusStacker)
+
+
+def test_split_into_stacks_keeps_natural_order():
+    paths = [f'/data/img_{i}.jpg' for i in (2, 10)]
+    stacks = _stacker().split_into_stacks(paths, 2)
+    assert stacks == [paths]
+
+
+def test_split_into_stacks_keeps_reference_first():
+    paths = [f'/data/img_{i}.jpg' for i in range(1, 12)]
+    stacks = _stacker().split_into_stacks(paths, 11)
+    assert stacks == [paths]
+    assert stacks[0][0] == '/data/img_1.jpg'
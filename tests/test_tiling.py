@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+np = pytest.importorskip('numpy')
+tiling = pytest.importorskip('tiling')
+
+
+@pytest.mark.parametrize('length', [1, 100, 512, 1000, 1023, 1024, 1025, 3000, 4096, 6001])
+@pytest.mark.parametrize('tile, overlap', [(512, 32), (256, 16), (1024, 64)])
+def test_tiles_cover_axis(length, tile, overlap):
+    starts = tiling.tile_starts(length, tile, overlap)
+    covered = np.zeros(length, dtype=int)
+    for start in starts:
+        covered[start:start + tile] += 1
+    assert covered.min() >= 1
+    assert starts == sorted(set(starts))
+    # Neighbours overlap by at least the ramp length
+    for prev, start in zip(starts, starts[1:]):
+        assert prev + tile - start >= overlap
+
+
+@pytest.mark.parametrize('length', [1, 100, 512, 1000, 1023, 1024, 1025, 3000, 4096, 6001])
+@pytest.mark.parametrize('tile, overlap', [(512, 32), (256, 16), (1024, 64)])
+def test_tile_weights_sum_to_one(length, tile, overlap):
+    starts = tiling.tile_starts(length, tile, overlap)
+    weights = tiling.tile_weights(starts, length, tile, overlap)
+    total = np.zeros(length, dtype=np.float64)
+    for start, w in zip(starts, weights):
+        assert len(w) == min(start + tile, length) - start
+        assert w.min() >= 0
+        total[start:start + len(w)] += w
+    np.testing.assert_allclose(total, 1.0, atol=1e-6)